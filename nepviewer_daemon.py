@@ -1,12 +1,17 @@
+import asyncio
+import json
 import logging
 import os
 import re
+import socket
 import sqlite3
+import tempfile
+import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from apscheduler.schedulers.blocking import BlockingScheduler
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
 
 DASHBOARD_URL = "https://user.nepviewer.com/dashboard"
@@ -14,6 +19,9 @@ LOGIN_URL = "https://user.nepviewer.com/"
 TIMEZONE = ZoneInfo("America/Bahia")
 
 SQLITE_PATH = os.environ.get("SQLITE_PATH", "nepviewer.db")
+# Perfil persistente do Chromium (cookies, cache HTTP, service workers)
+USER_DATA_DIR = os.environ.get("USER_DATA_DIR", "chromium-profile")
+# state.json legado: cookies importados apenas na criacao do perfil
 STATE_PATH = os.environ.get("STATE_PATH", "state.json")
 
 # Login selectors (ids fixos)
@@ -60,22 +68,82 @@ SUBMIT_SELECTORS = [
     "button:has-text('Sign in')",
 ]
 
-# XPath robusto (value dentro do box principal)
-POWER_XPATH = (
-    "(//div[contains(concat(' ',normalize-space(@class),' '),' main-box ')]"
-    "//div[contains(concat(' ',normalize-space(@class),' '),' statistics-box ')]"
-    "//div[contains(concat(' ',normalize-space(@class),' '),' static-item ')])[1]"
-    "//div[contains(concat(' ',normalize-space(@class),' '),' item-2 ')"
-    " and .//div[contains(concat(' ',normalize-space(@class),' '),' value ')]][1]"
-    "//div[contains(concat(' ',normalize-space(@class),' '),' value ')]"
-)
+# Visibilidade de vários seletores numa única chamada (mesmo critério do Playwright:
+# caixa não vazia e sem visibility:hidden). 1 = visível, 0 = não, -1 = seletor não é CSS puro
+VISIBLE_SELECTORS_JS = """(selectors) => selectors.map((sel) => {
+    let el;
+    try {
+        el = document.querySelector(sel);
+    } catch (e) {
+        return -1;
+    }
+    if (!el) return 0;
+    const rect = el.getBoundingClientRect();
+    return rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden' ? 1 : 0;
+})"""
+
+# Seletor do value dentro do box principal (CSS encadeado do Playwright; equivale ao
+# antigo XPath: 1º .static-item -> 1º .item-2 que tenha .value -> .value)
+POWER_SELECTOR = ".main-box .statistics-box .static-item >> nth=0 >> .item-2:has(.value) >> nth=0 >> .value"
+
+# Leitura via resposta XHR/fetch do proprio dashboard (opcional).
+# POWER_API_MATCH: trecho da URL da API que traz a potencia (ver aba Network do DevTools)
+# POWER_API_FIELD: caminho do valor no JSON, separado por ponto (ex.: data.power)
+POWER_API_MATCH = os.environ.get("POWER_API_MATCH", "").strip()
+POWER_API_FIELD = os.environ.get("POWER_API_FIELD", "").strip()
+
+# Hosts de analytics/telemetria (nao influenciam o valor lido) falham no DNS do proprio Chromium.
+# Sem context.route: qualquer rota no Playwright desliga o cache HTTP e o bundle do SPA
+# seria baixado de novo a cada recarga.
+BLOCKED_HOSTS = ("*.google-analytics.com", "*.googletagmanager.com", "*.hotjar.com", "*.sentry.io")
+
+# Flags do Chromium: dashboard só tem texto, então sem GPU/imagens e sem trabalho em background
+# (--no-sandbox o Playwright já passa por padrão)
+CHROMIUM_ARGS = [
+    "--lang=pt-BR",
+    "--disable-gpu",
+    "--blink-settings=imagesEnabled=false",
+    "--disable-dev-shm-usage",
+    "--disable-background-networking",
+    "--disable-renderer-backgrounding",
+    "--host-resolver-rules=" + ", ".join(f"MAP {h} ~NOTFOUND" for h in BLOCKED_HOSTS),
+]
+
+# Fallback: procura o label do card de potência instantânea (não o de energia em kWh)
+# e devolve o texto do .value no mesmo container
+FIND_POWER_JS = """() => {
+    for (const label of document.querySelectorAll('.label')) {
+        const t = label.innerText.trim();
+        const isPower = t.includes('Potência') || (t.includes('Power') && t.includes('(W)'));
+        if (!isPower || t.includes('kWh')) continue;
+        const value = label.parentElement && label.parentElement.querySelector('.value');
+        const v = value ? value.innerText.trim() : '';
+        if (v) return v;
+    }
+    return null;
+}"""
+
+# Número no formato pt-BR: 3.712,00
+_BR_NUMBER = re.compile(r"^\d{1,3}(?:\.\d{3})*(?:,\d+)?$")
+
+# HTML salvo quando a potência não é encontrada (apenas com LOG_LEVEL=DEBUG)
+DEBUG_HTML_PATH = os.environ.get("DEBUG_HTML_PATH", "/data/debug_page.html")
+DEBUG_DUMP_INTERVAL_SECONDS = 3600
 
 # Intervalo de coleta (segundos)
 INTERVAL_SECONDS = int(os.environ.get("INTERVAL_SECONDS", "60"))
 
-# Reinicia o browser a cada N coletas (ex.: 360 = 6h se 1/min)
+# Recicla a aba do browser a cada N coletas (ex.: 360 = 6h se 1/min)
 RESTART_EVERY_N_RUNS = int(os.environ.get("RESTART_EVERY_N_RUNS", "360"))
 
+# Recarrega o dashboard a cada N coletas; nas demais lê o valor já renderizado pelo SPA
+# (1 = recarrega sempre; valores maiores só se o SPA atualizar o valor sozinho)
+RELOAD_EVERY_N_RUNS = int(os.environ.get("RELOAD_EVERY_N_RUNS", "1"))
+
+# Buffer de leituras: grava em lote a cada N leituras ou T segundos (o que vier primeiro)
+FLUSH_EVERY_N_READINGS = 64
+FLUSH_INTERVAL_SECONDS = 30
+
 logging.basicConfig(
     level=os.environ.get("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s %(levelname)s %(message)s",
@@ -86,6 +154,11 @@ logger = logging.getLogger(__name__)
 def init_db():
     conn = sqlite3.connect(SQLITE_PATH)
     cur = conn.cursor()
+    # WAL persiste no arquivo do banco; fora de transacao (falha dentro de BEGIN)
+    cur.execute("PRAGMA journal_mode=WAL")
+    journal_mode = cur.fetchone()[0]
+    if journal_mode != "wal":
+        logger.warning("Nao foi possivel ativar WAL (journal_mode=%s)", journal_mode)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS nep_power (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,36 +166,65 @@ def init_db():
             power_w REAL NOT NULL
         )
     """)
+    # Retries no mesmo segundo não duplicam linhas; bancos antigos são deduplicados antes
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_nep_ts'")
+    if cur.fetchone() is None:
+        cur.execute("DELETE FROM nep_power WHERE id NOT IN (SELECT MIN(id) FROM nep_power GROUP BY ts_local)")
+        if cur.rowcount > 0:
+            logger.info("Removidas %s leituras duplicadas (mesmo ts_local)", cur.rowcount)
+        cur.execute("CREATE UNIQUE INDEX ux_nep_ts ON nep_power(ts_local)")
     conn.commit()
     conn.close()
 
 
-def save_reading(power_w: float):
-    ts_local = datetime.now(TIMEZONE).isoformat(timespec="seconds")
-    conn = sqlite3.connect(SQLITE_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO nep_power (ts_local, power_w) VALUES (?, ?)", (ts_local, power_w))
-    conn.commit()
-    conn.close()
-    logger.info("power_w=%s ts_local=%s", power_w, ts_local)
+def open_db() -> sqlite3.Connection:
+    # autocommit: cada INSERT e sua propria transacao (1 fsync com WAL + NORMAL)
+    conn = sqlite3.connect(SQLITE_PATH, isolation_level=None, check_same_thread=False)
+    # synchronous vale por conexao (nao persiste no arquivo como journal_mode)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def remove_stale_profile_lock(profile_dir: str) -> None:
+    # SingletonLock é um symlink para "hostname-pid" do Chromium dono do perfil. Só remove se
+    # esse processo não existe mais neste host (crash/container recriado); um Chromium órfão
+    # ainda vivo mantém o lock e o launch falha em vez de dois browsers no mesmo perfil
+    lock_path = os.path.join(profile_dir, "SingletonLock")
+    try:
+        target = os.readlink(lock_path)
+    except FileNotFoundError:
+        return
+    except OSError:
+        target = ""
+
+    host, _, pid = target.rpartition("-")
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+            alive = True
+        except ProcessLookupError:
+            alive = False
+        except PermissionError:
+            alive = True  # existe, mas é de outro usuário
+        if alive:
+            logger.warning("Perfil %s em uso pelo processo %s; lock mantido", profile_dir, pid)
+            return
+
+    for name in ("SingletonLock", "SingletonSocket", "SingletonCookie"):
+        try:
+            os.unlink(os.path.join(profile_dir, name))
+        except FileNotFoundError:
+            pass
+    logger.info("Lock antigo do perfil removido (%s)", target or lock_path)
 
 
 def parse_float(text: str) -> float:
     t = text.strip()
-    # pt-BR: 3.712,00
-    if re.match(r"^\d{1,3}(\.\d{3})*(,\d+)?$", t):
+    if _BR_NUMBER.match(t):
         t = t.replace(".", "").replace(",", ".")
     return float(t)
 
 
-def file_exists(path: str) -> bool:
-    try:
-        with open(path, "rb"):
-            return True
-    except FileNotFoundError:
-        return False
-
-
 class NepViewerRunner:
     def __init__(self, email: str, password: str, headless: bool = True):
         self.email = email
@@ -133,61 +235,189 @@ class NepViewerRunner:
         self.browser = None
         self.context = None
         self.page = None
+        self._power_locator = None
+        self.db = None
+
+        # (power_w, time.monotonic()) da ultima resposta da API interceptada
+        self._latest_power = None
+        # Ultimo valor salvo; leitura sem recarga igual a ele pode ser tela parada
+        self._last_power = None
+
+        self._last_dump_ts = None
+
+        self._buf: list[tuple[str, float]] = []
+        self._last_flush = time.monotonic()
 
         self.run_count = 0
 
-    def start(self):
-        self.pw = sync_playwright().start()
-        # Força locale pt-BR
-        self.browser = self.pw.chromium.launch(headless=self.headless, args=["--lang=pt-BR"])
+    async def start(self):
+        if self.db is None:
+            self.db = open_db()
 
-        # reaproveita sessão se existir state.json
-        if file_exists(STATE_PATH):
-            self.context = self.browser.new_context(storage_state=STATE_PATH, locale="pt-BR", timezone_id="America/Bahia")
-        else:
-            self.context = self.browser.new_context(locale="pt-BR", timezone_id="America/Bahia")
+        new_profile = not os.path.isdir(USER_DATA_DIR)
+        # Lock deixado por um Chromium anterior (crash/outro container) impede abrir o perfil
+        remove_stale_profile_lock(USER_DATA_DIR)
+
+        self.pw = await async_playwright().start()
+        try:
+            # Força locale pt-BR; o perfil em disco mantém a sessão entre reinícios
+            self.context = await self.pw.chromium.launch_persistent_context(
+                USER_DATA_DIR,
+                headless=self.headless,
+                locale="pt-BR",
+                timezone_id="America/Bahia",
+                args=CHROMIUM_ARGS,
+            )
+            self.browser = self.context.browser
 
-        self.page = self.context.new_page()
+            if new_profile and os.path.exists(STATE_PATH):
+                await self._import_legacy_state()
+
+            self._setup_page(self.context.pages[0] if self.context.pages else await self.context.new_page())
+        except Exception:
+            # Sem isso o Chromium já lançado segue vivo segurando o SingletonLock (e o driver
+            # do Playwright vaza): todo tick seguinte falharia com "perfil em uso"
+            await self.stop()
+            raise
+
+    async def _import_legacy_state(self):
+        # state.json ilegível não impede o launch: só segue sem os cookies (login normal)
+        try:
+            with open(STATE_PATH, encoding="utf-8") as f:
+                cookies = json.load(f).get("cookies", [])
+            await self.context.add_cookies(cookies)
+        except Exception as e:
+            logger.warning("Ignorando %s (nao foi possivel importar cookies): %s", STATE_PATH, e)
+            return
+        logger.info("Cookies importados de %s para o perfil %s", STATE_PATH, USER_DATA_DIR)
+
+    def _setup_page(self, page):
+        self.page = page
+        # Locator é lazy e sobrevive a navegações; só precisa ser refeito quando a aba muda
+        self._power_locator = page.locator(POWER_SELECTOR).first
+        if POWER_API_MATCH and POWER_API_FIELD:
+            self.page.on("response", self._on_response)
+
+    async def _recycle_page(self):
+        # Fechar a aba libera o processo de renderização (heap JS, DOM); perfil e cache ficam
+        old_page = self.page
+        self._setup_page(await self.context.new_page())
+        await old_page.close()
+        logger.info("Aba do dashboard reciclada")
+
+    async def stop(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("Falha ao gravar %s leituras pendentes: %s", len(self._buf), e)
 
-    def stop(self):
         try:
             if self.context:
-                self.context.close()
+                await self.context.close()
         finally:
             try:
                 if self.browser:
-                    self.browser.close()
+                    await self.browser.close()
             finally:
-                if self.pw:
-                    self.pw.stop()
+                try:
+                    if self.pw:
+                        await self.pw.stop()
+                finally:
+                    if self.db:
+                        self.db.close()
 
         self.pw = self.browser = self.context = self.page = None
-
-    def _first_visible(self, selectors):
-        for sel in selectors:
+        self._power_locator = None
+        self.db = None
+
+    def save_reading(self, power_w: float):
+        # Horário da leitura (não do flush). Formato fixo 2026-01-16T08:01:02-03:00: a web
+        # compara/ordena ts_local como texto; strftime("%z") daria -0300 e quebraria isso
+        ts_local = datetime.now(TIMEZONE).isoformat(timespec="seconds")
+        self._buf.append((ts_local, power_w))
+        logger.info("power_w=%s ts_local=%s", power_w, ts_local)
+
+        if (
+            len(self._buf) >= FLUSH_EVERY_N_READINGS
+            or time.monotonic() - self._last_flush > FLUSH_INTERVAL_SECONDS
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self._buf or self.db is None:
+            return
+
+        # Uma transacao (e um fsync) para o lote inteiro; em falha o buffer fica para a proxima
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany("INSERT OR IGNORE INTO nep_power (ts_local, power_w) VALUES (?, ?)", self._buf)
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+        logger.debug("%s leituras gravadas", len(self._buf))
+        self._buf.clear()
+        self._last_flush = time.monotonic()
+
+    async def _on_response(self, response):
+        if POWER_API_MATCH not in response.url:
+            return
+        if response.request.resource_type not in ("xhr", "fetch"):
+            return
+        try:
+            data = await response.json()
+            for key in POWER_API_FIELD.split("."):
+                data = data[int(key)] if isinstance(data, list) else data[key]
+            power_w = parse_float(data) if isinstance(data, str) else float(data)
+        except Exception as e:
+            logger.debug("Resposta da API ignorada (%s): %s", response.url, e)
+            return
+        self._latest_power = (power_w, time.monotonic())
+
+    def _take_api_power(self):
+        # So aceita valores capturados durante o tick atual
+        if self._latest_power is None:
+            return None
+        power_w, captured_at = self._latest_power
+        self._latest_power = None
+        if time.monotonic() - captured_at > INTERVAL_SECONDS:
+            return None
+        return power_w
+
+    async def _visible_flags(self, selectors):
+        try:
+            return await self.page.evaluate(VISIBLE_SELECTORS_JS, selectors)
+        except Exception as e:
+            # Ex.: contexto destruído no meio de uma navegação; checa um a um
+            logger.debug("Checagem de visibilidade em lote falhou: %s", e)
+            return [-1] * len(selectors)
+
+    async def _first_visible(self, selectors):
+        # 1 RPC para todos os seletores CSS; só os que o DOM não entende (ex.: :has-text) vão um a um
+        for sel, flag in zip(selectors, await self._visible_flags(selectors)):
+            if flag == 0:
+                continue
+            loc = self.page.locator(sel).first
+            if flag == 1:
+                return loc, sel
             try:
-                loc = self.page.locator(sel).first
-                if loc.is_visible():
+                if await loc.is_visible():
                     return loc, sel
             except Exception:
                 continue
         return None, None
 
-    def _looks_like_login(self) -> bool:
+    async def _looks_like_login(self) -> bool:
         url = self.page.url or ""
         if "redirect=" in url or "login" in url:
             return True
-        for sel in LOGIN_MARKER_SELECTORS:
-            try:
-                if self.page.locator(sel).first.is_visible():
-                    return True
-            except Exception:
-                continue
-        return False
+        loc, _ = await self._first_visible(LOGIN_MARKER_SELECTORS)
+        return loc is not None
 
-    def _attempt_login(self) -> bool:
-        email_loc, email_sel = self._first_visible(EMAIL_INPUT_SELECTORS)
-        pass_loc, pass_sel = self._first_visible(PASS_INPUT_SELECTORS)
+    async def _attempt_login(self) -> bool:
+        email_loc, email_sel = await self._first_visible(EMAIL_INPUT_SELECTORS)
+        pass_loc, pass_sel = await self._first_visible(PASS_INPUT_SELECTORS)
         if not email_loc or not pass_loc:
             logger.warning(
                 "Nao encontrei campos de login visiveis (email_sel=%s pass_sel=%s url=%s)",
@@ -197,14 +427,14 @@ class NepViewerRunner:
             )
             return False
 
-        email_loc.fill(self.email)
-        pass_loc.fill(self.password)
+        await email_loc.fill(self.email)
+        await pass_loc.fill(self.password)
 
-        submit_loc, submit_sel = self._first_visible(SUBMIT_SELECTORS)
+        submit_loc, submit_sel = await self._first_visible(SUBMIT_SELECTORS)
         if submit_loc:
-            submit_loc.click()
+            await submit_loc.click()
         else:
-            pass_loc.press("Enter")
+            await pass_loc.press("Enter")
             submit_sel = "Enter"
 
         logger.info(
@@ -215,11 +445,11 @@ class NepViewerRunner:
         )
         return True
 
-    def ensure_logged_in(self) -> bool:
+    async def ensure_logged_in(self) -> bool:
         # Tenta ir direto para o dashboard
         try:
             if not self.page.url.startswith(DASHBOARD_URL):
-                self.page.goto(DASHBOARD_URL, wait_until="domcontentloaded")
+                await self.page.goto(DASHBOARD_URL, wait_until="domcontentloaded")
         except Exception as e:
             logger.warning("Goto failed: %s", e)
 
@@ -233,169 +463,181 @@ class NepViewerRunner:
             # Selector do login: #form_item_account
             # Selector do dashboard: div.head-bar
             markers = ", ".join(LOGIN_MARKER_SELECTORS + [".head-bar"])
-            self.page.wait_for_selector(markers, timeout=20_000)
+            await self.page.wait_for_selector(markers, timeout=20_000)
         except Exception:
             logger.warning("Nao detectou nem Login nem Dashboard em %s", self.page.url)
 
         # Se parecer login, faz login
-        if self._looks_like_login():
+        if await self._looks_like_login():
             logger.info("Detectada tela de login. Autenticando...")
-            if not self._attempt_login():
+            if not await self._attempt_login():
                 return False
             # Espera navegar após login
             try:
-                self.page.wait_for_url("**/dashboard", timeout=60_000)
-                self.page.wait_for_selector(".head-bar", timeout=30_000)
-                # Salva cookies
-                self.context.storage_state(path=STATE_PATH)
+                await self.page.wait_for_url("**/dashboard", timeout=60_000)
+                await self.page.wait_for_selector(".head-bar", timeout=30_000)
             except Exception as e:
                 logger.warning("Falha ao esperar dashboard pos-login: %s (url=%s)", e, self.page.url)
                 return False
         elif self.page.url.startswith(DASHBOARD_URL):
             # Já estamos no dashboard; força refresh para garantir dados atuais
+            # (networkidle nunca assenta com os pollers XHR do SPA; espera o proprio valor)
             try:
-                self.page.reload(wait_until="networkidle")
+                await self.page.reload(wait_until="commit")
+                await self._power_locator.wait_for(state="attached", timeout=15_000)
             except Exception as e:
                 logger.warning("Falha ao recarregar dashboard: %s", e)
 
         if not self.page.url.startswith(DASHBOARD_URL):
             try:
-                self.page.goto(DASHBOARD_URL, wait_until="domcontentloaded")
+                await self.page.goto(DASHBOARD_URL, wait_until="domcontentloaded")
                 markers = ", ".join(LOGIN_MARKER_SELECTORS + [".head-bar"])
-                self.page.wait_for_selector(markers, timeout=20_000)
+                await self.page.wait_for_selector(markers, timeout=20_000)
             except Exception as e:
                 logger.warning("Nao foi possivel carregar dashboard: %s (url=%s)", e, self.page.url)
 
-            if self._looks_like_login():
+            if await self._looks_like_login():
                 logger.info("Detectada tela de login apos redirect. Autenticando...")
-                if not self._attempt_login():
+                if not await self._attempt_login():
                     return False
                 try:
-                    self.page.wait_for_url("**/dashboard", timeout=60_000)
-                    self.page.wait_for_selector(".head-bar", timeout=30_000)
-                    self.context.storage_state(path=STATE_PATH)
+                    await self.page.wait_for_url("**/dashboard", timeout=60_000)
+                    await self.page.wait_for_selector(".head-bar", timeout=30_000)
                 except Exception as e:
                     logger.warning("Falha ao esperar dashboard pos-login: %s (url=%s)", e, self.page.url)
                     return False
 
-        if not self.page.locator(".head-bar").is_visible():
+        if not await self.page.locator(".head-bar").is_visible():
             logger.warning("Dashboard nao confirmado (sem .head-bar visivel). url=%s", self.page.url)
             return False
 
         return True
 
-    def read_power(self) -> float:
-        logger.debug("Iniciando leitura. URL: %s | Titulo: %s", self.page.url, self.page.title())
+    async def _read_live_power(self):
+        # Caminho rápido: sem navegação, só lê o que o dashboard aberto já mostra
+        if not self.page.url.startswith(DASHBOARD_URL):
+            return None
+        api_power = self._take_api_power()
+        if api_power is not None:
+            return api_power
+        try:
+            power_w = parse_float(await self._power_locator.inner_text(timeout=2_000))
+        except Exception as e:
+            logger.debug("Leitura sem recarregar falhou; recarregando dashboard: %s", e)
+            return None
+        # Mesmo valor do tick anterior: não há como saber se o SPA atualizou o DOM, então recarrega
+        # (repetir um valor parado distorceria a integral de energia na web)
+        if power_w == self._last_power:
+            logger.debug("Valor sem recarga igual ao anterior (%s); recarregando dashboard", power_w)
+            return None
+        return power_w
+
+    async def read_power(self) -> float:
+        # page.title() é um RPC ao browser; só avalia quando DEBUG está ativo
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Iniciando leitura. URL: %s | Titulo: %s", self.page.url, await self.page.title())
 
         # Verifica se estamos na URL certa
         if not self.page.url.startswith(DASHBOARD_URL):
              logger.warning("Parece que nao estamos no dashboard. URL atual: %s", self.page.url)
 
         # Se caiu no login por redirecionamento, tenta autenticar novamente
-        if self._looks_like_login() or not self.page.url.startswith(DASHBOARD_URL):
+        if await self._looks_like_login() or not self.page.url.startswith(DASHBOARD_URL):
             logger.warning("Detectada tela de login durante leitura. Reautenticando...")
-            if not self.ensure_logged_in():
+            if not await self.ensure_logged_in():
                 raise PlaywrightTimeoutError("Não foi possível confirmar o dashboard para leitura.")
 
-        el = self.page.locator(f"xpath={POWER_XPATH}").first
+        # Valor vindo da API (capturado durante o carregamento do dashboard) dispensa o DOM
+        api_power = self._take_api_power()
+        if api_power is not None:
+            logger.debug("Potencia lida da resposta da API")
+            return api_power
+
+        el = self._power_locator
         try:
             # Tenta rápido primeiro
-            el.wait_for(state="visible", timeout=20_000)
-            txt = el.inner_text().strip()
+            await el.wait_for(state="visible", timeout=20_000)
+            txt = (await el.inner_text()).strip()
             return parse_float(txt)
         except Exception:
-            logger.debug("XPath especifico falhou ou timeout. Tentando varredura GLOBAL de labels...")
-            
-            # Tenta encontrar em todos os frames (caso use iframe)
-            all_labels = []
-            
-            # Main frame
-            main_labels = self.page.locator(".label").all()
-            all_labels.extend([(l, "main") for l in main_labels])
-            
-            # Sub-frames
-            for frame in self.page.frames:
-                try:
-                    fl = frame.locator(".label").all()
-                    if fl:
-                        logger.debug(
-                            "Encontrados %s labels no frame '%s' (%s)",
-                            len(fl),
-                            frame.name,
-                            frame.url,
-                        )
-                        all_labels.extend([(l, f"frame:{frame.name}") for l in fl])
-                except:
-                    pass
-
-            logger.debug("Total de labels encontrados (frames somados): %s", len(all_labels))
-
-            for i, (lbl_el, origin) in enumerate(all_labels):
+            logger.debug("Seletor especifico falhou ou timeout. Tentando pelo label de Potência...")
+
+            # Uma única chamada JS por frame; subframes (iframes) só se o main frame não tiver
+            for frame in [self.page.main_frame] + [f for f in self.page.frames if f != self.page.main_frame]:
                 try:
-                    lbl_txt = lbl_el.inner_text().strip()
-                    
-                    # Tenta achar o value no mesmo container pai
-                    # Assumindo estrutura: <div> <div class="value">...</div> <div class="label">...</div> </div>
-                    parent = lbl_el.locator("xpath=..")
-                    val_el = parent.locator(".value").first
-                    
-                    val_txt = "N/A"
-                    if val_el.count() > 0:
-                        val_txt = val_el.inner_text().strip()
-                        
-                    logger.debug(
-                        "[Global Item %s | %s] Label='%s' | Value='%s'",
-                        i,
-                        origin,
-                        lbl_txt,
-                        val_txt,
-                    )
-                    
-                    # Checagem mais estrita
-                    if ("Potência" in lbl_txt or "Power(W)" in lbl_txt or ("Power" in lbl_txt and "(W)" in lbl_txt)) and "kWh" not in lbl_txt:
-                         if val_txt and val_txt != "N/A":
-                            return parse_float(val_txt)
+                    txt = await frame.evaluate(FIND_POWER_JS)
                 except Exception as e:
-                    logger.debug("[Global Item %s] Ignorado (erro leitura): %s", i, e)
-            
+                    logger.debug("Falha ao procurar label no frame '%s' (%s): %s", frame.name, frame.url, e)
+                    continue
+                if txt:
+                    logger.debug("Potência encontrada pelo label no frame '%s': %s", frame.name, txt)
+                    return parse_float(txt)
+
             # Se chegou aqui, realmente não achou
-            # Dump do HTML para debug profundo
-            try:
-                with open("/data/debug_page.html", "w", encoding="utf-8") as f:
-                    f.write(self.page.content())
-                logger.debug("HTML completo salvo em /data/debug_page.html")
-            except Exception as e:
-                logger.warning("Falha ao salvar debug html: %s", e)
+            await self._dump_debug_html()
 
-            raise PlaywrightTimeoutError("Não foi possível encontrar campo de Potência (W) após varredura global.")
+            raise PlaywrightTimeoutError("Não foi possível encontrar campo de Potência (W) pelo seletor nem pelo label.")
 
-    def tick(self):
+    async def _dump_debug_html(self):
+        # Dump do HTML para debug profundo: só em DEBUG e no máximo 1x/hora (DOM pode ter MBs)
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        now = time.monotonic()
+        if self._last_dump_ts is not None and now - self._last_dump_ts < DEBUG_DUMP_INTERVAL_SECONDS:
+            return
+        self._last_dump_ts = now
+
+        try:
+            html = await self.page.content()
+            # Escreve num temporário e troca de uma vez, sem deixar arquivo pela metade
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(DEBUG_HTML_PATH) or ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(html)
+                os.replace(tmp_path, DEBUG_HTML_PATH)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            logger.debug("HTML completo salvo em %s", DEBUG_HTML_PATH)
+        except Exception as e:
+            logger.warning("Falha ao salvar debug html: %s", e)
+
+    async def tick(self):
         self.run_count += 1
 
-        # Reinício periódico pra evitar leak
-        if RESTART_EVERY_N_RUNS > 0 and (self.run_count % RESTART_EVERY_N_RUNS == 0):
-            self.stop()
+        # Reciclagem periódica da aba pra evitar leak (o browser continua aberto)
+        if RESTART_EVERY_N_RUNS > 0 and (self.run_count % RESTART_EVERY_N_RUNS == 0) and self.page is not None:
+            try:
+                await self._recycle_page()
+            except Exception as e:
+                logger.warning("Falha ao reciclar aba; reiniciando browser: %s", e)
+                await self.stop()
 
         # Garante que o browser esteja rodando (cobre 1ª execução, restart acima e crash anterior)
         if self.page is None:
-            self.start()
+            await self.start()
 
         try:
-            if not self.ensure_logged_in():
-                raise PlaywrightTimeoutError("Login não confirmado; pulando leitura.")
-            power_w = self.read_power()
-            save_reading(power_w)
+            power_w = None
+            if RELOAD_EVERY_N_RUNS > 1 and self.run_count % RELOAD_EVERY_N_RUNS != 0:
+                power_w = await self._read_live_power()
+            if power_w is None:
+                if not await self.ensure_logged_in():
+                    raise PlaywrightTimeoutError("Login não confirmado; pulando leitura.")
+                power_w = await self.read_power()
+            self.save_reading(power_w)
+            self._last_power = power_w
         except PlaywrightTimeoutError as e:
             logger.warning("timeout: %s", e)
-            self.stop()
+            await self.stop()
         except Exception as e:
             logger.warning("error: %s", e)
             # não derruba o scheduler; tenta de novo no próximo tick, possivelmente reabrindo o browser se tiver parado
             if self.page is None:
-                self.stop() # garante limpeza total se algo quebrou parcialmente
+                await self.stop() # garante limpeza total se algo quebrou parcialmente
 
 
-def main():
+async def main():
     init_db()
 
     email = os.environ.get("NEP_EMAIL", "").strip()
@@ -406,15 +648,18 @@ def main():
     headless_env = os.environ.get("HEADLESS", "true").lower() == "true"
     runner = NepViewerRunner(email, password, headless=headless_env)
 
-    sched = BlockingScheduler(timezone=TIMEZONE)
+    # tick é coroutine: o AsyncIOScheduler roda no mesmo event loop do Playwright
+    sched = AsyncIOScheduler(timezone=TIMEZONE)
     sched.add_job(runner.tick, "interval", seconds=INTERVAL_SECONDS, max_instances=1, coalesce=True)
 
     logger.info("Running every %ss. Ctrl+C to stop.", INTERVAL_SECONDS)
+    sched.start()
     try:
-        sched.start()
+        await asyncio.Event().wait()
     finally:
-        runner.stop()
+        sched.shutdown(wait=False)
+        await runner.stop()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
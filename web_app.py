@@ -1,11 +1,16 @@
 import os
 import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 from typing import List, Dict, Any, Tuple
 
+import numpy as np
+
 from fastapi import FastAPI, Query
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.requests import Request
@@ -14,39 +19,57 @@ from fastapi.requests import Request
 TIMEZONE = ZoneInfo("America/Bahia")
 SQLITE_PATH = os.environ.get("SQLITE_PATH", "nepviewer.db")
 
-app = FastAPI(title="NepViewer Power Dashboard", version="1.0.0")
+# Rótulos fixos dos 72 buckets de 20 minutos do dia (00:00 ... 23:40); bucket i = hora * 3 + minuto // 20
+BUCKET_LABELS = [f"{h:02d}:{m:02d}" for h in range(24) for m in (0, 20, 40)]
+
+app = FastAPI(title="NepViewer Power Dashboard", version="1.0.0", default_response_class=ORJSONResponse)
 
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-def db_connect():
-    return sqlite3.connect(SQLITE_PATH)
+_local = threading.local()
 
 
-def parse_ts(ts_local: str) -> datetime:
-    # ts_local foi salvo via datetime.now(ZoneInfo("America/Bahia")).isoformat(timespec="seconds")
-    # Ex: 2026-01-16T08:01:02-03:00
-    return datetime.fromisoformat(ts_local)
+def db_connect() -> sqlite3.Connection:
+    # Uma conexão somente leitura por thread do FastAPI, aberta uma vez e reaproveitada.
+    # Em WAL os leitores não bloqueiam o coletor (nem uns aos outros).
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(f"{Path(SQLITE_PATH).resolve().as_uri()}?mode=ro", uri=True)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA cache_size=-16384")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
+    return conn
 
 
-def load_rows_between(start_dt: datetime, end_dt: datetime) -> List[Tuple[datetime, float]]:
+def load_rows_between(start_s: str, end_s: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Retorna (ts, power_w) como arrays paralelos, ordenados por ts, com start_s <= ts_local < end_s
+    (limites em ISO8601, ver iso_bounds).
+    ts é datetime64[s] do relógio local (o offset é descartado: todas as linhas estão no
+    mesmo fuso, então diferenças e dias batem com o datetime aware).
+    """
     conn = db_connect()
     cur = conn.cursor()
-    # Seleciona tudo e filtra em Python para evitar depender do parsing de timezone do SQLite.
-    cur.execute("SELECT ts_local, power_w FROM nep_power ORDER BY ts_local ASC")
-    rows = []
-    for ts_local, power_w in cur.fetchall():
-        try:
-            dt = parse_ts(ts_local)
-        except Exception:
-            continue
-        if start_dt <= dt < end_dt:
-            rows.append((dt, float(power_w)))
-    conn.close()
-    return rows
+    # ts_local é ISO8601 com offset fixo (-03:00): ordem de texto == ordem cronológica,
+    # então o filtro vai para o SQL e usa o índice único em ts_local.
+    cur.execute(
+        "SELECT ts_local, power_w FROM nep_power WHERE ts_local >= ? AND ts_local < ? ORDER BY ts_local ASC",
+        (start_s, end_s),
+    )
+    # Loop simples é mais rápido que substr() no SQL ou np.fromiter direto do cursor
+    ts_text: List[str] = []
+    power: List[float] = []
+    for ts_local, power_w in cur:
+        ts_text.append(ts_local[:19])
+        power.append(power_w)
+    return np.array(ts_text, dtype="datetime64[s]"), np.array(power, dtype=np.float64)
 
 
+@lru_cache(maxsize=512)
 def month_bounds(ym: str) -> Tuple[datetime, datetime]:
     # ym: "YYYY-MM"
     y, m = ym.split("-")
@@ -59,6 +82,7 @@ def month_bounds(ym: str) -> Tuple[datetime, datetime]:
     return start, end
 
 
+@lru_cache(maxsize=512)
 def day_bounds(ymd: str) -> Tuple[datetime, datetime]:
     # ymd: "YYYY-MM-DD"
     y, m, d = ymd.split("-")
@@ -68,149 +92,170 @@ def day_bounds(ymd: str) -> Tuple[datetime, datetime]:
     return start, end
 
 
-def aggregate_daily_energy(rows: List[Tuple[datetime, float]]) -> Tuple[Dict[str, float], float]:
+def iso_bounds(start: datetime, end: datetime) -> Tuple[str, str]:
+    # Mesmo formato gravado pelo coletor (2026-01-16T00:00:00-03:00): os filtros por período
+    # comparam texto, sem montar datetime por linha
+    return start.isoformat(timespec="seconds"), end.isoformat(timespec="seconds")
+
+
+def aggregate_daily_energy(ts: np.ndarray, p: np.ndarray) -> Tuple[Dict[str, float], float]:
     # agrupa por dia (YYYY-MM-DD) calculando energia em kWh (integral trapezoidal)
     # Retorna: (dicionario_dia_valor, total_periodo)
-    
-    if not rows:
+    # Em SQL (LAG + julianday + GROUP BY dia) a mesma conta é mais lenta que integrar aqui
+
+    if len(ts) < 2:
         return {}, 0.0
 
     # Garante ordenação
-    rows.sort(key=lambda x: x[0])
-    
-    daily_energy: Dict[str, float] = {}
-    total_energy = 0.0
-    
-    # Processa intervalos entre pontos consecutivos
-    for i in range(1, len(rows)):
-        dt_curr, p_curr = rows[i]
-        dt_prev, p_prev = rows[i-1]
-        
-        # Diferença de tempo em horas
-        delta_seconds = (dt_curr - dt_prev).total_seconds()
-        
-        # Se o gap for muito grande (ex: > 1 hora), ignoramos a integração nesse intervalo
-        # assumindo que o sistema estava desligado ou sem coleta.
-        if delta_seconds > 3600:
-            continue
-            
-        delta_hours = delta_seconds / 3600.0
-        
-        # Regra do trapézio: área = (b1 + b2) * h / 2
-        # Potência média no intervalo (W) * tempo (h) = Wh
-        # / 1000 -> kWh
-        avg_power = (p_curr + p_prev) / 2.0
-        energy_kwh = (avg_power * delta_hours) / 1000.0
-        
-        # Atribui ao dia do ponto final (dt_curr)
-        day_key = dt_curr.date().isoformat()
-        
-        daily_energy[day_key] = daily_energy.get(day_key, 0.0) + energy_kwh
-        total_energy += energy_kwh
-
-    # Formata arredondando
-    result = {k: float(f"{v:.2f}") for k, v in sorted(daily_energy.items())}
-    total_period = float(f"{total_energy:.2f}")
-    
+    order = np.argsort(ts, kind="stable")
+    ts = ts[order]
+    p = p[order]
+
+    # Intervalos entre pontos consecutivos, em horas
+    delta_hours = np.diff(ts).astype(np.float64) / 3600.0
+
+    # Se o gap for muito grande (ex: > 1 hora), ignoramos a integração nesse intervalo
+    # assumindo que o sistema estava desligado ou sem coleta.
+    valid = delta_hours <= 1.0
+
+    # Regra do trapézio: potência média no intervalo (W) * tempo (h) = Wh; / 1000 -> kWh
+    energy_kwh = np.where(valid, (p[1:] + p[:-1]) * 0.5 * delta_hours / 1000.0, 0.0)
+
+    # Atribui ao dia do ponto final de cada intervalo
+    days = ts[1:].astype("datetime64[D]")
+    day_index = (days - days[0]).astype(np.int64)
+    daily = np.bincount(day_index, weights=energy_kwh)
+    has_data = np.bincount(day_index, weights=valid) > 0
+
+    # Formata arredondando (float() antes: round() de np.float64 usa o arredondamento do NumPy)
+    result = {
+        str(days[0] + i): round(float(daily[i]), 2)
+        for i in np.flatnonzero(has_data)
+    }
+    total_period = round(float(energy_kwh.sum()), 2)
+
     return result, total_period
 
 
-def aggregate_20min_full_day(rows: List[Tuple[datetime, float]], day_start: datetime) -> Tuple[List[str], List[Any]]:
+def aggregate_20min_full_day(ts: np.ndarray, p: np.ndarray, day_start: datetime) -> Tuple[List[str], List[Any]]:
     """
     Agrupa por média a cada 20 minutos e retorna as 72 posições do dia (00:00 ... 23:40).
     labels -> lista de HH:MM, values -> médias ou None quando não houve ponto no bucket.
     """
-    buckets: Dict[str, List[float]] = {}
-
-    for dt, val in rows:
-        # Encaixa o ponto no bucket de 20 minutos mais próximo para baixo
-        bucket_dt = dt.replace(minute=(dt.minute // 20) * 20, second=0, microsecond=0)
-        key = bucket_dt.strftime("%H:%M")
-        buckets.setdefault(key, []).append(val)
-
-    labels: List[str] = []
-    values: List[Any] = []
+    day_start = day_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    n_buckets = len(BUCKET_LABELS)
 
-    t = day_start.replace(hour=0, minute=0, second=0, microsecond=0)
-    end = t + timedelta(days=1)
+    # Índice do bucket de 20 minutos (para baixo) de cada ponto, a partir de 00:00
+    offset = ts - np.datetime64(day_start.replace(tzinfo=None), "s")
+    bucket = (offset // np.timedelta64(20, "m")).astype(np.int64)
+    in_day = (bucket >= 0) & (bucket < n_buckets)
 
-    while t < end:
-        label = t.strftime("%H:%M")
-        labels.append(label)
-        bucket_vals = buckets.get(label)
-        values.append(round(sum(bucket_vals) / len(bucket_vals), 2) if bucket_vals else None)
-        t += timedelta(minutes=20)
+    sums = np.bincount(bucket[in_day], weights=p[in_day], minlength=n_buckets)
+    counts = np.bincount(bucket[in_day], minlength=n_buckets)
 
-    return labels, values
+    values: List[Any] = [
+        round(float(sums[i]) / int(counts[i]), 2) if counts[i] else None
+        for i in range(n_buckets)
+    ]
+    return list(BUCKET_LABELS), values
 
 
 def load_recent_bucketed(limit: int = 10, bucket_minutes: int = 10) -> List[Dict[str, Any]]:
     conn = db_connect()
     cur = conn.cursor()
+    # max_rows é só um teto: o loop para no (limit+1)-ésimo bucket, sem GROUP BY sobre o teto todo
     max_rows = max(2000, limit * bucket_minutes * 20)
     cur.execute("SELECT ts_local, power_w FROM nep_power ORDER BY ts_local DESC LIMIT ?", (max_rows,))
-    rows = cur.fetchall()
-    conn.close()
 
-    buckets: Dict[str, Dict[str, Any]] = {}
-    order: List[str] = []
+    # Soma/contagem por bucket (dict mantém a ordem de inserção: mais recente primeiro)
+    sums: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
 
-    for ts_local, power_w in rows:
+    for ts_local, power_w in cur:
+        # Só precisa do "YYYY-MM-DDTHH:MM" do bucket: fatia o texto em vez de montar datetime
         try:
-            dt = parse_ts(ts_local)
-        except Exception:
+            minute = int(ts_local[14:16])
+        except ValueError:
             continue
-        bucket_dt = dt.replace(minute=(dt.minute // bucket_minutes) * bucket_minutes, second=0, microsecond=0)
-        key = bucket_dt.isoformat(timespec="minutes")
-        if key not in buckets:
-            if len(order) >= limit:
+        key = f"{ts_local[:14]}{(minute // bucket_minutes) * bucket_minutes:02d}"
+        if key not in sums:
+            if len(sums) >= limit:
                 break
-            buckets[key] = {"dt": bucket_dt, "sum": 0.0, "count": 0}
-            order.append(key)
-        buckets[key]["sum"] += float(power_w)
-        buckets[key]["count"] += 1
+            sums[key] = 0.0
+            counts[key] = 0
+        sums[key] += power_w
+        counts[key] += 1
+    # A conexão é reaproveitada: encerra o SELECT interrompido pelo break
+    cur.close()
 
-    result: List[Dict[str, Any]] = []
-    for key in order:
-        bucket = buckets[key]
-        avg = bucket["sum"] / bucket["count"] if bucket["count"] else 0.0
-        result.append({
-            "label": bucket["dt"].strftime("%Y-%m-%d %H:%M"),
-            "value": float(f"{avg:.2f}"),
-        })
-
-    return result
+    return [
+        {"label": key.replace("T", " "), "value": round(sums[key] / counts[key], 2)}
+        for key in sums
+    ]
 
 
 def load_recent_raw(limit: int = 10) -> List[Dict[str, Any]]:
     conn = db_connect()
     cur = conn.cursor()
     cur.execute("SELECT ts_local, power_w FROM nep_power ORDER BY ts_local DESC LIMIT ?", (limit * 5,))
-    rows = cur.fetchall()
-    conn.close()
 
     result: List[Dict[str, Any]] = []
-    for ts_local, power_w in rows:
-        try:
-            dt = parse_ts(ts_local)
-        except Exception:
-            continue
-        if power_w is None:
-            continue
-        try:
-            val = float(power_w)
-        except Exception:
+    for ts_local, power_w in cur:
+        # "2026-01-16T08:01:02-03:00" -> "2026-01-16 08:01:02" sem parse/strftime
+        if len(ts_local) < 19 or power_w is None:
             continue
+        # power_w é REAL: o sqlite3 já devolve float
         result.append({
-            "label": dt.strftime("%Y-%m-%d %H:%M:%S"),
-            "value": float(f"{val:.2f}"),
+            "label": f"{ts_local[:10]} {ts_local[11:19]}",
+            "value": round(power_w, 2),
         })
         if len(result) >= limit:
             break
+    cur.close()
 
     return result
 
 
+def db_version() -> Tuple[float, float]:
+    # Muda a cada gravação do coletor: com WAL o INSERT vai para o -wal e só o checkpoint
+    # altera o arquivo principal, então as duas datas de modificação entram na chave.
+    try:
+        db_mtime = os.path.getmtime(SQLITE_PATH)
+    except OSError:
+        db_mtime = 0.0
+    try:
+        wal_mtime = os.path.getmtime(SQLITE_PATH + "-wal")
+    except OSError:
+        wal_mtime = 0.0
+    return db_mtime, wal_mtime
+
+
+@lru_cache(maxsize=128)
+def month_series(ym: str, version: Tuple[float, float]) -> Tuple[List[str], List[float], float]:
+    # version só participa da chave do cache (ver db_version)
+    start_s, end_s = iso_bounds(*month_bounds(ym))
+    ts, p = load_rows_between(start_s, end_s)
+
+    # Agrega energia diária
+    agg, total_kwh = aggregate_daily_energy(ts, p)
+    return list(agg.keys()), list(agg.values()), total_kwh
+
+
+@lru_cache(maxsize=128)
+def day_series(ymd: str, version: Tuple[float, float]) -> Tuple[List[str], List[Any], float]:
+    # version só participa da chave do cache (ver db_version)
+    start, end = day_bounds(ymd)
+    start_s, end_s = iso_bounds(start, end)
+    ts, p = load_rows_between(start_s, end_s)
+
+    # Agrega média a cada 20 min e preenche todos os 72 pontos do dia
+    labels, values = aggregate_20min_full_day(ts, p, start)
+
+    # PICO do dia (máximo valor registrado nos dados brutos)
+    max_power = float(p.max()) if p.size else 0.0
+    return labels, values, max_power
+
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
     # defaults: mês atual e dia atual no fuso America/Bahia
@@ -243,15 +288,8 @@ def api_series(
 
     if mode == "month":
         ym = month or now.strftime("%Y-%m")
-        start, end = month_bounds(ym)
-        rows = load_rows_between(start, end)
-        
-        # Agrega energia diária
-        agg, total_kwh = aggregate_daily_energy(rows)
-        
-        labels = list(agg.keys())
-        values = list(agg.values())
-        
+        labels, values, total_kwh = month_series(ym, db_version())
+
         title = f"Energia (kWh) - Total diário ({ym})"
         return {
             "mode": mode,
@@ -267,17 +305,8 @@ def api_series(
 
     # mode == "day"
     ymd = day or now.strftime("%Y-%m-%d")
-    start, end = day_bounds(ymd)
-    rows = load_rows_between(start, end)
-    
-    # Agrega média a cada 20 min e preenche todos os 72 pontos do dia
-    labels, values = aggregate_20min_full_day(rows, start)
-    
-    # Calcula PICO do dia (máximo valor registrado nos dados brutos)
-    max_power = 0.0
-    if rows:
-        max_power = max(r[1] for r in rows)
-    
+    labels, values, max_power = day_series(ymd, db_version())
+
     title = f"Potência (W) - Média 20min ({ymd})"
     return {
         "mode": mode,
@@ -285,7 +314,7 @@ def api_series(
         "labels": labels,
         "values": values,
         "stat_label": "Pico",
-        "stat_value": float(f"{max_power:.2f}"),
+        "stat_value": round(max_power, 2),
         "stat_unit": "W",
         "recent_rows": recent_rows,
         "recent_raw": recent_raw,